@@ -0,0 +1,387 @@
+import json
+import random
+
+import pytest
+
+import main
+
+
+JSON_DOCUMENTS = [
+    {"a": 1.5, "b": 2},
+    {"a": -12, "b": [1e5, -2.5E-3, 0, 0.25], "c": {"d": 1234567.875}},
+    {"facts": {"us-gaap": {"Revenues": {"units": {"USD": [{"val": -0.5, "fy": 2023}]}}}}, "x": [True, None]},
+    {"s": "split é text \\\" here", "n": [10, 200, 3000, -4e10, 5.125e-7]},
+]
+
+
+def _walk(reader):
+    # descend into objects key by key, as parse_companyfacts_chunks does, so leaf values are
+    # decoded on their own and can end at a chunk boundary
+    if reader.peek() != "{":
+        return reader.read_value()
+    return {key: _walk(reader) for key in reader.iter_keys()}
+
+
+def _read_whole(chunks):
+    reader = main.JsonChunkReader(chunks)
+    value = _walk(reader)
+    assert reader.peek() == ""
+    return value
+
+
+def _split(data, cuts):
+    points = [0] + sorted(cuts) + [len(data)]
+    return [data[a:b] for a, b in zip(points, points[1:])]
+
+
+def test_read_value_number_split_after_dot(monkeypatch):
+    monkeypatch.setattr(main, "STREAM_CHUNK_SIZE", 8)
+    assert _read_whole([b'{"a": 1.', b'5, "b": 2}']) == {"a": 1.5, "b": 2}
+    assert _read_whole([b'{"a": 1e', b'5, "b": -', b'2}']) == {"a": 1e5, "b": -2}
+
+
+def test_read_value_matches_json_loads_for_every_chunk_split(monkeypatch):
+    monkeypatch.setattr(main, "STREAM_CHUNK_SIZE", 8)
+    rng = random.Random(12)
+    for doc in JSON_DOCUMENTS:
+        data = json.dumps(doc, ensure_ascii=False).encode("utf-8")
+        expected = json.loads(data)
+        for cut in range(1, len(data)):
+            assert _read_whole(_split(data, [cut])) == expected
+        for _ in range(200):
+            cuts = rng.sample(range(1, len(data)), rng.randint(2, min(12, len(data) - 1)))
+            assert _read_whole(_split(data, cuts)) == expected
+
+
+RATIO_INDUSTRIES = main.INDUSTRIES
+
+
+def _ratio_records(rng, count):
+    # missing (None -> NaN column cells), zero and negative values for every input, so each
+    # denominator guard in calculate_ratios is exercised
+    choices = [None, None, 0, 0.0, -1.0, -250.5, 1.0, 3.0, 17.25, 1e3, 4.2e6, 1.5e9]
+    records = []
+    for _ in range(count):
+        record = {}
+        for name in main.RATIO_INPUTS:
+            value = rng.choice(choices)
+            if value is not None:
+                record[name] = value
+        records.append(record)
+    return records
+
+
+def _same_ratio(expected, actual):
+    if expected is None or expected != expected:
+        return actual is None or actual != actual
+    return actual == expected
+
+
+def _assert_ratio_parity(records, industries, columns):
+    for i, (record, industry) in enumerate(zip(records, industries)):
+        scalar = main.calculate_ratios(dict(record), industry)
+        for name in set(scalar) | set(columns):
+            actual = columns[name][i] if name in columns else None
+            assert _same_ratio(scalar.get(name), actual), (industry, name, record, scalar.get(name), actual)
+
+
+def test_calculate_ratios_batch_matches_scalar_path():
+    rng = random.Random(15)
+    records = _ratio_records(rng, 60 * len(RATIO_INDUSTRIES))
+    industries = [RATIO_INDUSTRIES[i % len(RATIO_INDUSTRIES)] for i in range(len(records))]
+    _assert_ratio_parity(records, industries, main.calculate_ratios_batch(records, industries))
+    for industry in RATIO_INDUSTRIES:
+        _assert_ratio_parity(records, [industry] * len(records), main.calculate_ratios_batch(records, industry))
+
+
+def test_history_ratios_match_scalar_path():
+    rng = random.Random(13)
+    for industry in RATIO_INDUSTRIES:
+        records = _ratio_records(rng, 40)
+        columns = {name: main.array("d", [main._column_value(r.get(name)) for r in records])
+                   for name in main.RATIO_INPUTS}
+        history = main.FundamentalsHistory("annual", [f"20{i:02d}-12-31" for i in range(len(records))], columns)
+        ratios = main.history_ratios(history, industry)
+        _assert_ratio_parity([history.row(i) for i in range(len(records))], [industry] * len(records), ratios)
+
+
+def _fact(start, end, val, form="10-Q", fy=2024, fp="Q2", filed="2024-08-01"):
+    return {"start": start, "end": end, "val": val, "form": form, "fy": fy, "fp": fp, "filed": filed}
+
+
+def test_ttm_value_uses_an_annual_fact_ending_on_the_date():
+    unit = main.UnitFacts([_fact("2023-01-01", "2023-12-31", 1000, "10-K"),
+                           _fact("2023-10-01", "2023-12-31", 260)])
+    assert unit.ttm_value("2023-12-31") == (1000, "annual")
+
+
+def test_ttm_value_ytd_plus_fiscal_year_minus_prior_ytd():
+    unit = main.UnitFacts([_fact("2023-01-01", "2023-12-31", 1000, "10-K"),
+                           _fact("2023-01-01", "2023-06-30", 400),
+                           _fact("2024-01-01", "2024-06-30", 500)])
+    assert unit.ttm_value("2024-06-30") == (1100, "ytd")
+
+
+def test_ttm_value_ytd_tolerances():
+    # 52/53-week years: the fiscal year may end up to 3 days from the day before the YTD starts, and
+    # the prior-year YTD may end up to 7 days from a year earlier with a length within 7 days
+    within = main.UnitFacts([_fact("2022-12-31", "2023-12-28", 1000, "10-K"),
+                             _fact("2022-12-31", "2023-07-06", 400),
+                             _fact("2024-01-01", "2024-06-30", 500)])
+    assert within.ttm_value("2024-06-30") == (1100, "ytd")
+
+    fiscal_year_too_far = main.UnitFacts([_fact("2022-12-27", "2023-12-27", 1000, "10-K"),
+                                          _fact("2022-12-27", "2023-06-30", 400),
+                                          _fact("2024-01-01", "2024-06-30", 500)])
+    assert fiscal_year_too_far.ttm_value("2024-06-30") is None
+
+    # start 2 days off and length 6 days off are allowed; the end is 8 days from a year earlier
+    prior_ytd_too_far = main.UnitFacts([_fact("2023-01-01", "2023-12-31", 1000, "10-K"),
+                                        _fact("2023-01-03", "2023-07-09", 400),
+                                        _fact("2024-01-01", "2024-06-30", 500)])
+    assert prior_ytd_too_far.ttm_value("2024-06-30") is None
+
+
+def test_ttm_value_chains_four_quarters():
+    quarters = [("2023-07-01", "2023-09-30", 10), ("2023-10-01", "2023-12-30", 20),
+                ("2024-01-02", "2024-03-31", 30), ("2024-04-01", "2024-06-30", 40)]
+    unit = main.UnitFacts([_fact(s, e, v) for s, e, v in quarters])
+    # Q4 ends 2023-12-30 and Q1 starts 2024-01-02: a 2-day gap is inside the 3-day tolerance
+    assert unit.ttm_value("2024-06-30") == (100, "quarters")
+
+    gap = quarters[:1] + [("2023-10-01", "2023-12-26", 20)] + quarters[2:]
+    assert main.UnitFacts([_fact(s, e, v) for s, e, v in gap]).ttm_value("2024-06-30") is None
+    assert main.UnitFacts([_fact(s, e, v) for s, e, v in quarters[1:]]).ttm_value("2024-06-30") is None
+
+
+def test_ttm_value_without_a_match():
+    unit = main.UnitFacts([_fact("2023-01-01", "2023-12-31", 1000, "10-K")])
+    assert unit.ttm_value("2024-06-30") is None
+    assert unit.ttm_value("not a date") is None
+
+
+def test_fact_store_ttm_records_methods():
+    store = main.FactStore({"facts": {"us-gaap": {
+        "Revenues": {"units": {"USD": [_fact("2023-01-01", "2023-12-31", 1000, "10-K"),
+                                       _fact("2023-01-01", "2023-06-30", 400),
+                                       _fact("2024-01-01", "2024-06-30", 500)]}},
+        "Assets": {"units": {"USD": [{"end": "2023-12-31", "val": 7000, "form": "10-K"},
+                                     {"end": "2024-06-30", "val": 7500, "form": "10-Q"}]}},
+    }}})
+    data = store.ttm()
+    assert data["Revenue"] == 1100
+    assert data["Assets"] == 7500
+    assert data["_report_end_date"] == "2024-06-30"
+    assert data["_ttm_methods"]["Revenue"] == "ytd"
+
+
+def _screen_table():
+    np = main.np
+    columns = {
+        "Net_Margin": np.array([25.0, 10.0, np.nan, 40.0, 20.0]),
+        "Debt_to_Equity": np.array([0.2, 1.5, 0.1, np.nan, 0.5]),
+    }
+    return main.ScreenTable(["AAA", "BBB", "CCC", "DDD", "EEE"], ["1", "2", "3", "4", "5"],
+                            ["A", "B", "C", "D", "E"], ["Technology", "Bank", "Technology", "REIT", "Technology"],
+                            [None] * 5, columns, built_at=0)
+
+
+def test_parse_screen_filters():
+    assert main.parse_screen_filters("Net_Margin>20, Debt_to_Equity<=0.5,ROE==1e1") == [
+        ("Net_Margin", ">", 20.0), ("Debt_to_Equity", "<=", 0.5), ("ROE", "=", 10.0)]
+    assert main.parse_screen_filters("") == []
+    with pytest.raises(ValueError):
+        main.parse_screen_filters("Net_Margin>>20")
+
+
+def test_screen_table_select_and_rank():
+    table = _screen_table()
+    # boundary values: > excludes 20, <= includes 0.5; NaN cells never match
+    mask = table.select([("Net_Margin", ">", 20.0)])
+    assert [table.tickers[i] for i in table.ranked(mask, "Net_Margin", descending=True)] == ["DDD", "AAA"]
+    mask = table.select([("Net_Margin", ">=", 20.0), ("Debt_to_Equity", "<=", 0.5)])
+    assert [table.tickers[i] for i in table.ranked(mask, "Debt_to_Equity")] == ["AAA", "EEE"]
+    mask = table.select([("Debt_to_Equity", "=", 1.5)])
+    assert [table.tickers[i] for i in table.ranked(mask)] == ["BBB"]
+    # rows missing the sort column come last
+    mask = table.select([], ["Technology"])
+    assert [table.tickers[i] for i in table.ranked(mask, "Net_Margin")] == ["EEE", "AAA", "CCC"]
+
+
+def test_api_screen_matches_industry_case_insensitively(monkeypatch):
+    monkeypatch.setattr(main.SCREENER, "universe_spec", "AAA")
+    monkeypatch.setattr(main.SCREENER, "table", _screen_table())
+    monkeypatch.setattr(main.SCREENER, "_thread", object())
+    client = main.app.test_client()
+    response = client.get("/api/screen?industry=technology,reit&filter=Net_Margin>20&sort=-Net_Margin")
+    assert response.status_code == 200
+    assert [row["ticker"] for row in response.json["results"]] == ["DDD", "AAA"]
+    assert client.get("/api/screen?industry=tech").status_code == 400
+
+
+OCCUPANCY_FRAGMENTS = [
+    "As of December 31, 2024, our portfolio was 94.6% leased",
+    "The percent leased was 9 . 5 % higher",
+    "Percent leased: 96.2%",
+    "percentage leased remained 91 percent",
+    "Same store occupancy increased 1.2% to 93.4%",
+    "occupancy decreased approximately 0.8% to 88.1%",
+    "Our properties are substantially leased, with 97.5% leased at year end",
+    "Occupancy: 72%",
+    "approximately 99% of our portfolio",
+    "the portfolio is 89.9% occupied",
+    "Stabilization means achieving 90% leased",
+    "rent growth of 4.5% for leased space",
+    "cash basis occupancy was 85.0%",
+    "leased 150% of the target",
+    "The Company owns 42 properties",
+    "Revenue rose 12% year over year",
+    "For the year ended December 31, 2024",
+    "\n\n   ",
+    "?",
+    "!",
+    "; and",
+]
+
+
+def _occupancy_text(rng):
+    parts = rng.choices(OCCUPANCY_FRAGMENTS, k=rng.randint(1, 12))
+    return rng.choice([". ", " ", "\n"]).join(parts) + rng.choice(["", ".", " 93%"])
+
+
+def test_occupancy_from_text_matches_reference_scan():
+    from occupancy_reference import occupancy_from_text_reference
+
+    rng = random.Random(18)
+    for _ in range(400):
+        text = _occupancy_text(rng)
+        assert main._occupancy_from_text(text) == occupancy_from_text_reference(text), text
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _QueuedRefresher:
+    """Stands in for the refresh executor: holds submitted refreshes until run() is called."""
+
+    def __init__(self):
+        self.queued = []
+
+    def submit(self, fn):
+        self.queued.append(fn)
+
+    def run(self):
+        queued, self.queued = self.queued, []
+        for fn in queued:
+            fn()
+
+
+def _swr_fundamentals(monkeypatch, results):
+    """get_fundamentals over a fresh CACHE (ttl 60, negative ttl 5, max_stale 300) and a fake clock;
+    each rebuild returns the next of `results`."""
+    clock, refresher = _Clock(), _QueuedRefresher()
+    monkeypatch.setattr(main, "time", clock)
+    monkeypatch.setattr(main, "CACHE", main.TTLCache(
+        "fundamentals", 60, negative_ttl=5, is_negative=main._is_incomplete_result,
+        max_stale=300, refresher=refresher))
+    calls = []
+
+    def fetch(ticker, mode="annual"):
+        calls.append(ticker)
+        return results[len(calls) - 1]
+
+    monkeypatch.setattr(main, "fetch_comprehensive_fundamentals", fetch)
+    return clock, refresher, calls
+
+
+def test_stale_result_served_with_one_background_refresh(monkeypatch):
+    clock, refresher, calls = _swr_fundamentals(monkeypatch, [{"v": 1}, {"v": 2}])
+    assert main.get_fundamentals("AAA") == {"v": 1}
+    clock.now += 30
+    assert main.get_fundamentals("AAA") == {"v": 1}
+    assert calls == ["AAA"] and not refresher.queued
+
+    clock.now += 60
+    for _ in range(3):
+        stale = main.get_fundamentals("AAA")
+        assert stale["v"] == 1
+        assert stale["data_quality"] == {"stale": True, "cache_age_seconds": 90.0}
+    # served without computing in the request path, and the refresh is scheduled only once
+    assert calls == ["AAA"] and len(refresher.queued) == 1
+    assert main.CACHE.stale_served == 3 and main.CACHE.refreshes == 1
+
+    refresher.run()
+    assert calls == ["AAA", "AAA"]
+    assert main.get_fundamentals("AAA") == {"v": 2}
+
+
+@pytest.mark.parametrize("incomplete", [
+    {"error": "SEC unavailable"},
+    {"v": 1, "data_quality": {"stage_timeouts": ["market"]}},
+])
+def test_incomplete_result_never_served_stale(monkeypatch, incomplete):
+    clock, refresher, calls = _swr_fundamentals(monkeypatch, [incomplete, {"v": 2}])
+    assert main.get_fundamentals("AAA") == incomplete
+    # cached for the negative TTL, then recomputed in the request path rather than served stale
+    clock.now += 6
+    assert main.get_fundamentals("AAA") == {"v": 2}
+    assert calls == ["AAA", "AAA"] and not refresher.queued
+    assert main.CACHE.stale_served == 0
+
+
+def test_result_past_max_stale_recomputed_in_request_path(monkeypatch):
+    clock, refresher, calls = _swr_fundamentals(monkeypatch, [{"v": 1}, {"v": 2}])
+    main.get_fundamentals("AAA")
+    clock.now += 60 + 300
+    assert main.get_fundamentals("AAA") == {"v": 2}
+    assert calls == ["AAA", "AAA"] and not refresher.queued
+    assert main.CACHE.stale_served == 0
+
+
+class _InlinePool:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+def _dispatch_times(monkeypatch, entries, cycle, max_rate):
+    """Times at which one CacheWarmer cycle dispatches `entries` rebuilds, on a fake clock."""
+    clock = _Clock()
+    monkeypatch.setattr(main, "time", clock)
+    monkeypatch.setattr(main, "sleep", lambda seconds: setattr(clock, "now", clock.now + seconds))
+    monkeypatch.setattr(main.TICKER_INDEX, "is_loaded", lambda: True)
+    warmer = main.CacheWarmer(watchlist="AAA", modes=["annual"], cycle=cycle, workers=2, max_rate=max_rate)
+    monkeypatch.setattr(warmer, "entries", lambda: [(f"T{i}", "annual") for i in range(entries)])
+    times = []
+
+    def warm(ticker, mode, progress):
+        times.append(clock.now)
+        warmer._slots.release()
+
+    monkeypatch.setattr(warmer, "_warm", warm)
+    assert warmer._run_cycle(_InlinePool(), clock.now)
+    return times
+
+
+def test_warmer_dispatch_rate_stays_under_ceiling(monkeypatch):
+    # 300 entries in a 60s cycle would be 5/s; the 2/s ceiling stretches the pass to 150s
+    times = _dispatch_times(monkeypatch, 300, cycle=60, max_rate=2)
+    assert len(times) == 300
+    for i in range(len(times)):
+        in_window = [t for t in times[i:] if t < times[i] + 1]
+        assert len(in_window) <= 2
+    assert times[-1] - times[0] >= 149
+
+    # under the ceiling the entries are spread evenly over the cycle
+    times = _dispatch_times(monkeypatch, 30, cycle=60, max_rate=2)
+    assert [round(b - a, 6) for a, b in zip(times, times[1:])] == [2.0] * 29
+
+
+def test_default_watchlist_cycle_skips_recently_rebuilt_entries():
+    # a cycle under twice CACHE_TTL would rebuild entries that are still fresh
+    assert main.WATCHLIST_CYCLE / 2 >= main.CACHE_TTL
+    assert main.WATCHLIST_CYCLE < main.CACHE_TTL + main.CACHE_MAX_STALE